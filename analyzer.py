@@ -1,25 +1,64 @@
 import pandas as pd
 import argparse
+from collections import Counter, defaultdict
 from pathlib import Path
 
-def generate_report(df):
+# Columns the report needs; everything else in the file is skipped while reading.
+REPORT_COLUMNS = ['State', 'Severity', 'Issue', 'IP', 'Region', 'Recurring Issue']
+
+# Low-cardinality columns are parsed as categoricals; the rest stay as strings.
+REPORT_DTYPES = defaultdict(lambda: str, {
+    col: 'category' for col in ['State', 'Severity', 'Issue', 'Region']
+})
+
+# Number of rows read into memory at a time.
+CHUNK_SIZE = 200_000
+
+def counts_to_series(counter, name):
+    """
+    Converts a Counter into a value_counts-style Series, most common first.
+    """
+    return pd.Series(dict(counter.most_common()), name='count', dtype=int).rename_axis(name)
+
+
+def generate_report(chunks):
     """
-    Analyzes the dataframe and prints a formatted report to the console.
+    Analyzes the dataframe chunks and prints a formatted report to the console.
+    Counts are accumulated per chunk, so the full file is never held in memory.
     """
     # --- Data Preparation ---
-    # Ensure 'State' column exists and filter for open issues
-    if 'State' not in df.columns or df['State'].dropna().empty:
+    # Accumulate counts for open issues one chunk at a time
+    counters = {col: Counter() for col in ['Severity', 'Issue', 'IP', 'Region']}
+    columns = set()
+    has_state = False
+    total_open = 0
+    recurring_count = 0
+
+    for chunk in chunks:
+        columns.update(chunk.columns)
+        if 'State' not in chunk.columns:
+            break
+        has_state = has_state or not chunk['State'].dropna().empty
+
+        df_open = chunk[chunk['State'].str.strip().str.lower() == 'open']
+        total_open += len(df_open)
+
+        for col, counter in counters.items():
+            if col in df_open.columns:
+                counter.update(df_open[col].str.strip().value_counts().to_dict())
+
+        # Convert 'Recurring Issue' to a number for calculation
+        recurring = pd.to_numeric(df_open['Recurring Issue'], errors='coerce').fillna(0)
+        recurring_count += int((recurring > 0).sum())
+
+    # Ensure 'State' column exists before reporting on open issues
+    if not has_state:
         print("'State' column is missing or empty. Cannot filter for open issues.")
         return
 
-    df_open = df[df['State'].str.strip().str.lower() == 'open'].copy()
-    
-    if df_open.empty:
+    if total_open == 0:
         print("✅ No 'open' issues found to analyze.")
         return
-        
-    # Convert 'Recurring Issue' to a number for calculation
-    df_open['Recurring Issue'] = pd.to_numeric(df_open['Recurring Issue'], errors='coerce').fillna(0)
 
     # --- Report Generation ---
     print("\n" + "="*50)
@@ -28,34 +67,33 @@ def generate_report(df):
 
     # 1. Overall Summary
     print("\n--- 📊 Overall Summary ---")
-    print(f"Total Open Issues: {len(df_open)}")
-    if 'Severity' in df_open.columns:
+    print(f"Total Open Issues: {total_open}")
+    if 'Severity' in columns:
         print("\nBreakdown by Severity:")
-        severity_counts = df_open['Severity'].str.strip().value_counts()
+        severity_counts = counts_to_series(counters['Severity'], 'Severity')
         print(severity_counts.to_string())
     
     # 2. Top Offenders
     print("\n--- 🎯 Top 5 Most Common Issues ---")
-    if 'Issue' in df_open.columns:
-        top_issues = df_open['Issue'].str.strip().value_counts().nlargest(5)
+    if 'Issue' in columns:
+        top_issues = counts_to_series(counters['Issue'], 'Issue').head(5)
         print(top_issues.to_string())
     
     print("\n--- 💻 Top 5 IPs with Most Open Issues ---")
-    if 'IP' in df_open.columns:
-        top_ips = df_open['IP'].str.strip().value_counts().nlargest(5)
+    if 'IP' in columns:
+        top_ips = counts_to_series(counters['IP'], 'IP').head(5)
         print(top_ips.to_string())
 
     # 3. Geographical Distribution
     print("\n--- 🌍 Issues by Region ---")
-    if 'Region' in df_open.columns and not df_open['Region'].dropna().empty:
-        region_counts = df_open['Region'].str.strip().value_counts()
+    if counters['Region']:
+        region_counts = counts_to_series(counters['Region'], 'Region')
         print(region_counts.to_string())
     else:
         print("No region data available.")
 
     # 4. Recurring Problems
     print("\n--- 🔄 Recurring Issues ---")
-    recurring_count = len(df_open[df_open['Recurring Issue'] > 0])
     print(f"Total issues that are recurring: {recurring_count}")
 
     print("\n" + "="*50)
@@ -82,8 +120,13 @@ def main():
 
     print(f"Reading data from '{destination_file}'...")
     try:
-        df = pd.read_csv(destination_file, dtype=str)
-        generate_report(df)
+        chunks = pd.read_csv(
+            destination_file,
+            dtype=REPORT_DTYPES,
+            usecols=lambda col: col in REPORT_COLUMNS,
+            chunksize=CHUNK_SIZE
+        )
+        generate_report(chunks)
     except Exception as e:
         print(f"Failed to read or process the file. Reason: {e}")
 
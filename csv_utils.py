@@ -0,0 +1,95 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+# Shared CSV helpers for the toolkit scripts, built on PyArrow's multithreaded
+# CSV reader and writer. Every column is read as text, like dtype=str in pandas.
+
+# Quoted cells may span lines (e.g., notes typed into 'Description'), which Arrow
+# only handles when told to; without it, files larger than one block fail to parse.
+PARSE_OPTIONS = pacsv.ParseOptions(newlines_in_values=True)
+
+# Arrow rejects a row with fewer fields than the header, which pandas pads with
+# missing values. Such files are read with pandas instead, with the same text values.
+PANDAS_OPTIONS = dict(dtype=str, keep_default_na=False, na_values=[''])
+
+def read_csv_header(path):
+    """
+    Reads the column names from the header row of a CSV.
+    """
+    try:
+        with pacsv.open_csv(path, parse_options=PARSE_OPTIONS) as reader:
+            return reader.schema.names
+    except pa.ArrowInvalid:
+        return list(pd.read_csv(path, nrows=0, **PANDAS_OPTIONS).columns)
+
+def string_convert_options(column_names, include_columns=None):
+    """
+    Returns conversion options that keep the given columns as text,
+    with empty cells read as missing values.
+    """
+    return pacsv.ConvertOptions(
+        column_types={name: pa.string() for name in column_names},
+        include_columns=include_columns,
+        strings_can_be_null=True
+    )
+
+def read_csv_as_strings(path, columns=None, parse_dates=()):
+    """
+    Reads a CSV, keeping every column as text.
+    If columns is given, only those that exist in the file are parsed.
+    Columns in parse_dates are converted to timestamps while still in Arrow form;
+    if any value is not ISO 8601, that column is left as text instead.
+    Files Arrow cannot parse are read with pandas, leaving every column as text.
+    """
+    column_names = read_csv_header(path)
+    if columns is not None:
+        column_names = [name for name in column_names if name in columns]
+    convert_options = string_convert_options(column_names, include_columns=column_names)
+    try:
+        table = pacsv.read_csv(path, parse_options=PARSE_OPTIONS, convert_options=convert_options)
+    except pa.ArrowInvalid:
+        usecols = None if columns is None else (lambda name: name in columns)
+        return pd.read_csv(path, usecols=usecols, **PANDAS_OPTIONS)
+    for name in parse_dates:
+        if name in table.column_names:
+            try:
+                parsed = table.column(name).cast(pa.timestamp('ns'))
+            except pa.ArrowInvalid:
+                continue
+            table = table.set_column(table.column_names.index(name), name, parsed)
+    return table.to_pandas()
+
+def iter_csv_batches(path, block_size):
+    """
+    Streams a CSV as record batches of roughly block_size bytes, keeping every
+    column as text. Only one batch is held in memory at a time.
+    """
+    convert_options = string_convert_options(read_csv_header(path))
+    read_options = pacsv.ReadOptions(block_size=block_size)
+    with pacsv.open_csv(
+        path, read_options=read_options, parse_options=PARSE_OPTIONS, convert_options=convert_options
+    ) as reader:
+        yield from reader
+
+def iter_csv_batches_with_pandas(path, chunksize=200_000):
+    """
+    Streams a CSV with pandas in chunks of chunksize rows, as Arrow record batches
+    like iter_csv_batches. Used for files Arrow cannot parse.
+    """
+    with pd.read_csv(path, chunksize=chunksize, **PANDAS_OPTIONS) as reader:
+        for chunk in reader:
+            yield from pa.Table.from_pandas(chunk, preserve_index=False).to_batches()
+
+def write_csv(df, path, mode='wb', include_header=True):
+    """
+    Writes a DataFrame as CSV. Datetime columns are written as text first so they
+    keep pandas' formatting. Every text field is quoted, so rows appended to a file
+    written by pandas are quoted while the older rows are not; both read back the same.
+    """
+    datetime_columns = df.select_dtypes(include=['datetime', 'datetimetz']).columns
+    df = df.assign(**{col: df[col].astype(str).where(df[col].notna()) for col in datetime_columns})
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    write_options = pacsv.WriteOptions(include_header=include_header, batch_size=200_000)
+    with open(path, mode) as f:
+        pacsv.write_csv(table, f, write_options=write_options)
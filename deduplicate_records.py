@@ -1,6 +1,10 @@
 import pandas as pd
 import os
 import argparse
+from csv_utils import read_csv_as_strings, write_csv
+
+# Low-cardinality key columns are stored as categoricals.
+CATEGORY_COLUMNS = ['Severity', 'Protocol', 'State']
 
 def deduplicate_and_update(source_file, output_file):
     """
@@ -10,7 +14,8 @@ def deduplicate_and_update(source_file, output_file):
     # --- 1. Load the Data ---
     try:
         print(f"Loading data from '{source_file}'...")
-        df = pd.read_csv(source_file, dtype=str, low_memory=False)
+        df = read_csv_as_strings(source_file, parse_dates=['Timestamp'])
+        df = df.astype({col: 'category' for col in CATEGORY_COLUMNS if col in df.columns})
         print(f"Found {len(df)} total records.")
     except FileNotFoundError:
         print(f"Error: Source file not found at '{source_file}'")
@@ -20,9 +25,11 @@ def deduplicate_and_update(source_file, output_file):
         return
 
     # --- 2. Prepare the Data for Processing ---
-    # Convert Timestamp to a datetime object to allow for correct sorting.
+    # Timestamp is normally parsed while reading. If the reader left it as text,
+    # convert it here to allow for correct sorting.
     # Errors will be converted to 'NaT' (Not a Time), which can be handled.
-    df['Timestamp'] = pd.to_datetime(df['Timestamp'], errors='coerce')
+    if not pd.api.types.is_datetime64_any_dtype(df['Timestamp']):
+        df['Timestamp'] = pd.to_datetime(df['Timestamp'], errors='coerce')
 
     # Convert 'Recurring Issue' to a numeric type for calculations.
     # Invalid parsing will be set as 0.
@@ -32,7 +39,10 @@ def deduplicate_and_update(source_file, output_file):
     key_columns = ['Severity', 'IP', 'Protocol', 'Port', 'State']
 
     # Drop rows where key identifiers or the timestamp are missing.
-    df.dropna(subset=key_columns + ['Timestamp'], inplace=True)
+    mask = df['Timestamp'].notna()
+    for col in key_columns:
+        mask &= df[col].notna()
+    df = df[mask]
 
     # --- 3. Sort and Identify Duplicates ---
     # Sort by the key columns and then by Timestamp in descending order.
@@ -41,37 +51,29 @@ def deduplicate_and_update(source_file, output_file):
     df_sorted = df.sort_values(by=key_columns + ['Timestamp'], ascending=[True]*len(key_columns) + [False])
 
     # Group by the key columns to find duplicates.
-    grouped = df_sorted.groupby(key_columns)
-    
-    final_records = []
+    grouped = df_sorted.groupby(key_columns, sort=False, observed=True)
     
-    print(f"Processing {len(grouped)} unique issue groups...")
+    print(f"Processing {grouped.ngroups} unique issue groups...")
     
-    for _, group in grouped:
-        # The first row in each group is the latest one, which we will keep.
-        latest_record = group.iloc[0].copy()
-        
-        # The number of duplicates is the size of the group minus the one we're keeping.
-        num_duplicates = len(group) - 1
-        
-        if num_duplicates > 0:
-            # Add the count of removed duplicates to the existing recurring count.
-            latest_record['Recurring Issue'] += num_duplicates
-            
-        final_records.append(latest_record)
+    # The number of duplicates is the size of the group minus the one we're keeping.
+    # Add it to the existing recurring count of every row; only the first survives.
+    num_duplicates = grouped['Recurring Issue'].transform('size') - 1
+    df_sorted['Recurring Issue'] = df_sorted['Recurring Issue'] + num_duplicates
+
+    # The first row in each group is the latest one, which we will keep.
+    df_final = df_sorted.drop_duplicates(subset=key_columns, keep='first')
 
-    # --- 4. Create and Save the Final DataFrame ---
-    if not final_records:
+    # --- 4. Save the Final DataFrame ---
+    if df_final.empty:
         print("No valid records found to process.")
         return
-        
-    df_final = pd.DataFrame(final_records)
     
     # Sort the final result by timestamp for a clean, chronological view.
-    df_final = df_final.sort_values(by='Timestamp', ascending=False)
+    # A stable sort keeps records with equal timestamps in key order.
+    df_final = df_final.sort_values(by='Timestamp', ascending=False, kind='mergesort')
     
     try:
-        df_final.to_csv(output_file, index=False)
+        write_csv(df_final, output_file)
         print("\n--- Success! ---")
         print(f"Removed {len(df) - len(df_final)} redundant records.")
         print(f"Saved {len(df_final)} unique records to '{output_file}'")
@@ -5,7 +5,12 @@ import os
 import zipfile
 import io
 import re
+import shutil
+import tempfile
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -21,8 +26,28 @@ DOWNLOAD_FOLDER = r'd:\PD\shadow_intel_processor\src'
 # CRITERIA: fetch unread emails from Shadowserver
 SEARCH_CRITERIA = '(UNSEEN FROM "enter the email address here")'
 
+# Precompiled patterns for filenames and report links
+INVALID_FILENAME_CHARS_RE = re.compile(r'[\\/*?:"<>|]')
+CONTENT_DISPOSITION_FILENAME_RE = re.compile(r'filename="?([^"]+)"?')
+SHADOWSERVER_URL_RE = re.compile(r'(https://dl\.shadowserver\.org/\S+)')
+
+# Number of report links downloaded in parallel
+MAX_DOWNLOAD_WORKERS = 16
+
+# Each download thread keeps its own HTTP session for connection reuse
+thread_local = threading.local()
+
+def get_session():
+    if not hasattr(thread_local, "session"):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        thread_local.session = session
+    return thread_local.session
+
 def clean_filename(filename):
-    return re.sub(r'[\\/*?:"<>|]', "", filename)
+    return INVALID_FILENAME_CHARS_RE.sub("", filename)
 
 def download_file_from_url(url, target_dir, log_callback):
     """
@@ -30,14 +55,14 @@ def download_file_from_url(url, target_dir, log_callback):
     """
     try:
         # Stream the request to check headers first
-        with requests.get(url, stream=True) as r:
+        with get_session().get(url, stream=True) as r:
             r.raise_for_status()
             
             # Try to get the real filename from the Content-Disposition header
             filename = ""
             if "Content-Disposition" in r.headers:
                 cd = r.headers["Content-Disposition"]
-                filenames = re.findall(r'filename="?([^"]+)"?', cd)
+                filenames = CONTENT_DISPOSITION_FILENAME_RE.findall(cd)
                 if filenames:
                     filename = filenames[0]
             
@@ -54,23 +79,32 @@ def download_file_from_url(url, target_dir, log_callback):
             if os.path.exists(filepath):
                 return 0
 
-            # Download the content
-            file_content = r.content
+            # Stream the content to a temporary file in 1 MiB blocks
+            r.raw.decode_content = True
+            with tempfile.NamedTemporaryFile(delete=False, dir=target_dir, suffix=".part") as tmp:
+                tmp_path = tmp.name
+                try:
+                    shutil.copyfileobj(r.raw, tmp, length=1 << 20)
+                except Exception:
+                    tmp.close()
+                    os.unlink(tmp_path)
+                    raise
 
             # Handle Zip files
             if filename.endswith(".zip"):
                 try:
-                    with zipfile.ZipFile(io.BytesIO(file_content)) as z:
+                    with zipfile.ZipFile(tmp_path) as z:
                         z.extractall(target_dir)
                         log_callback(f"  Link Processed: Extracted {filename}")
                         return 1
                 except zipfile.BadZipFile:
                     log_callback(f"  Bad Zip from link: {filename}", "error")
                     return 0
+                finally:
+                    os.unlink(tmp_path)
             else:
                 # Save regular file
-                with open(filepath, "wb") as f:
-                    f.write(file_content)
+                os.replace(tmp_path, filepath)
                 log_callback(f"  Link Downloaded: {filename}")
                 return 1
 
@@ -78,6 +112,15 @@ def download_file_from_url(url, target_dir, log_callback):
         log_callback(f"  ❌ Failed to download link {url}: {e}", "error")
         return 0
 
+def download_link(url, target_dir):
+    """
+    Downloads a report link in a worker thread. Log messages are collected and
+    returned with the file count instead of being logged from the worker.
+    """
+    messages = []
+    count = download_file_from_url(url, target_dir, lambda *args: messages.append(args))
+    return count, messages
+
 def download_shadowserver_reports(username, password, server=IMAP_SERVER, target_dir=DOWNLOAD_FOLDER, log_callback=print):
     if not os.path.exists(target_dir):
         os.makedirs(target_dir)
@@ -100,63 +143,75 @@ def download_shadowserver_reports(username, password, server=IMAP_SERVER, target
         
         count = 0
         processed_urls = set()
+        urls_to_fetch = []
 
         # Process latest 20 emails to avoid taking too long (Adjust as needed)
-        for email_id in reversed(email_ids[-20:]):
-            res, msg = mail.fetch(email_id, "(RFC822)")
-            for response in msg:
-                if isinstance(response, tuple):
-                    msg = email.message_from_bytes(response[1])
-                    subject, encoding = decode_header(msg["Subject"])[0]
-                    if isinstance(subject, bytes):
-                        subject = subject.decode(encoding if encoding else "utf-8")
+        # Fetch them in a single round-trip; each message arrives as a (header, body) tuple
+        res, data = mail.fetch(b",".join(email_ids[-20:]), "(RFC822)")
+        for response in reversed(data):
+            if isinstance(response, tuple):
+                msg = email.message_from_bytes(response[1])
+                subject, encoding = decode_header(msg["Subject"])[0]
+                if isinstance(subject, bytes):
+                    subject = subject.decode(encoding if encoding else "utf-8")
+                
+                # 1. Walk through parts to find Attachments OR Text Body
+                for part in msg.walk():
+                    content_type = part.get_content_type()
+                    content_disposition = str(part.get("Content-Disposition"))
                     
-                    # 1. Walk through parts to find Attachments OR Text Body
-                    for part in msg.walk():
-                        content_type = part.get_content_type()
-                        content_disposition = str(part.get("Content-Disposition"))
-                        
-                        # A) Handle Direct Attachments
-                        if "attachment" in content_disposition:
-                            filename = part.get_filename()
-                            if filename:
-                                filename = clean_filename(filename)
-                                if filename.endswith(".csv") or filename.endswith(".zip"):
-                                    filepath = os.path.join(target_dir, filename)
-                                    if not os.path.exists(filepath):
-                                        payload = part.get_payload(decode=True)
-                                        if filename.endswith(".zip"):
-                                            try:
-                                                with zipfile.ZipFile(io.BytesIO(payload)) as z:
-                                                    z.extractall(target_dir)
-                                                    log_callback(f"  Attachment Extracted: {filename}")
-                                                    count += 1
-                                            except: pass
-                                        else:
-                                            with open(filepath, "wb") as f:
-                                                f.write(payload)
-                                            log_callback(f"  Attachment Saved: {filename}")
-                                            count += 1
-
-                        # B) Handle Links in Text Body
-                        elif content_type == "text/plain":
-                            try:
-                                body = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                                # Regex to find Shadowserver DL links
-                                found_urls = re.findall(r'(https://dl\.shadowserver\.org/\S+)', body)
+                    # A) Handle Direct Attachments
+                    if "attachment" in content_disposition:
+                        filename = part.get_filename()
+                        if filename:
+                            filename = clean_filename(filename)
+                            if filename.endswith(".csv") or filename.endswith(".zip"):
+                                filepath = os.path.join(target_dir, filename)
+                                if not os.path.exists(filepath):
+                                    payload = part.get_payload(decode=True)
+                                    if filename.endswith(".zip"):
+                                        try:
+                                            with zipfile.ZipFile(io.BytesIO(payload)) as z:
+                                                z.extractall(target_dir)
+                                                log_callback(f"  Attachment Extracted: {filename}")
+                                                count += 1
+                                        except: pass
+                                    else:
+                                        with open(filepath, "wb") as f:
+                                            f.write(payload)
+                                        log_callback(f"  Attachment Saved: {filename}")
+                                        count += 1
+
+                    # B) Handle Links in Text Body
+                    elif content_type == "text/plain":
+                        try:
+                            body = part.get_payload(decode=True).decode('utf-8', errors='ignore')
+                            # Regex to find Shadowserver DL links
+                            found_urls = SHADOWSERVER_URL_RE.findall(body)
+                            
+                            for url in found_urls:
+                                # Clean trailing punctuation often found in emails
+                                url = url.rstrip('.,)>]')
                                 
-                                for url in found_urls:
-                                    # Clean trailing punctuation often found in emails
-                                    url = url.rstrip('.,)>]')
-                                    
-                                    if url not in processed_urls:
-                                        processed_urls.add(url)
-                                        count += download_file_from_url(url, target_dir, log_callback)
-                            except Exception as e:
-                                log_callback(f"Error parsing text body: {e}", "error")
+                                if url not in processed_urls:
+                                    processed_urls.add(url)
+                                    urls_to_fetch.append(url)
+                        except Exception as e:
+                            log_callback(f"Error parsing text body: {e}", "error")
 
         mail.close()
         mail.logout()
+
+        # 2. Download all collected links in parallel
+        if urls_to_fetch:
+            log_callback(f"Downloading {len(urls_to_fetch)} report links...")
+            with ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as executor:
+                results = executor.map(lambda url: download_link(url, target_dir), urls_to_fetch)
+                # Log from this thread only, since log_callback may drive a UI that is not thread-safe
+                for link_count, messages in results:
+                    for args in messages:
+                        log_callback(*args)
+                    count += link_count
         
         if count > 0:
             log_callback(f"Success! {count} new report files added to src.", "success")
@@ -1,18 +1,18 @@
 import os
 import re
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
+from csv_utils import read_csv_header, read_csv_as_strings, write_csv
 
 # === Paths ===
 source_dir = r'd:\PD\shadow_intel_processor\src'
 destination_file = r'd:\PD\shadow_intel_processor\dst\destination.csv'
 processed_log_path = r'd:\PD\shadow_intel_processor\dst\processed_files.txt'
-
-# === Automatically create destination directory if it doesn't exist ===
-destination_dir = os.path.dirname(destination_file)
-if not os.path.exists(destination_dir):
-    print(f"Destination directory not found. Creating it at: {destination_dir}")
-    os.makedirs(destination_dir)
+recurring_index_path = r'd:\PD\shadow_intel_processor\dst\recurring_index.parquet'
 
 # === Mapping: Source → Destination Columns ===
 column_map = {
@@ -35,74 +35,155 @@ destination_columns = [
     'Date Issue Resolved', 'Contact Person', 'Contact Email'
 ]
 
+# === Columns identifying a recurring issue ===
+key_columns = ['Severity', 'IP', 'Protocol', 'Port', 'State', 'Issue']
+
+# === Low-cardinality key columns, stored as categoricals when loaded from the destination ===
+category_columns = ['Severity', 'Protocol', 'State', 'Issue']
+
+# === Strip whitespace from the given columns only, where present ===
+def strip_columns(df, columns):
+    for col in columns:
+        if col in df.columns:
+            df[col] = df[col].str.strip()
+    return df
+
+# === Check whether a non-empty file ends with a line break ===
+# Editors often save the last row without one, and rows appended after it would join that row.
+def ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+# === Format timestamps as text with a fixed layout ===
+# astype(str) drops the time when every value is at midnight, which would make the same
+# instant from two files compare as different. The UTC offset is kept for tz-aware values.
+def format_timestamps(timestamps):
+    text = timestamps.dt.strftime('%Y-%m-%d %H:%M:%S')
+    if timestamps.dt.tz is not None:
+        text = text + timestamps.dt.strftime('%z').str.replace(r'(\d{2})$', r':\1', regex=True)
+    return text.where(timestamps.notna())
+
 # === Extract issue name from filename ===
+issue_pattern = re.compile(r'scan_([^-.]+)')
+
 def extract_issue_from_filename(filename):
-    match = re.search(r'scan_([^-.]+)', filename)
+    match = issue_pattern.search(filename)
     if match:
         return match.group(1).replace('_', ' ').strip().lower()
     return None
 
-# === Load already processed files ===
-try:
-    with open(processed_log_path, 'r') as f:
-        processed_files = set(f.read().splitlines())
-except FileNotFoundError:
-    processed_files = set()
+# === Recurring Issue index ===
+# One row per key: the highest 'Recurring Issue' seen with its Timestamp, and the highest
+# seen with any other Timestamp. That is all a lookup needs, however often the key recurs.
+index_columns = ['Timestamp 1', 'Recurring Issue 1', 'Timestamp 2', 'Recurring Issue 2']
+entry_columns = key_columns + ['Timestamp', 'Recurring Issue']
 
-# === Load destination or create fresh ===
-if os.path.exists(destination_file):
-    try:
-        df_dest = pd.read_csv(destination_file, dtype=str).apply(
-            lambda x: x.str.strip() if x.dtype == "object" else x
-        )
-        print(f"Loaded existing destination file: {destination_file}")
-    except Exception as e:
-        print(f"Failed to read existing destination file: {e}")
-        df_dest = pd.DataFrame(columns=destination_columns)
-else:
-    df_dest = pd.DataFrame(columns=destination_columns)
-
-# Ensure all required columns exist
-for col in destination_columns:
-    if col not in df_dest.columns:
-        df_dest[col] = ""
-
-# === Track new files processed this run ===
-newly_processed = []
-
-# === Process each file ===
-for filename in os.listdir(source_dir):
-    if not (filename.endswith('.csv') or filename.endswith('.xlsx')):
-        continue
-    if filename in processed_files:
-        print(f"Skipping already processed file: {filename}")
-        continue
-
-    print(f"Processing new file: {filename}")
-    file_path = os.path.join(source_dir, filename)
-
-    # Read source
+# Highest 'Recurring Issue' per (key, Timestamp); rows with a missing key are left out
+def max_per_timestamp(df, key_columns):
+    return (
+        df.dropna(subset=key_columns)
+        .groupby(key_columns + ['Timestamp'], sort=False, dropna=False, observed=True)['Recurring Issue']
+        .max()
+        .reset_index()
+    )
+
+# Keeps the two highest (Timestamp, Recurring Issue) entries of each key
+def build_recurring_index(entries, key_columns):
+    best = max_per_timestamp(entries, key_columns).sort_values('Recurring Issue', ascending=False, kind='stable')
+    rank = best.groupby(key_columns, sort=False, observed=True).cumcount()
+    top = best[rank == 0].merge(best[rank == 1], on=key_columns, how='left', suffixes=(' 1', ' 2'))
+    return top.astype({'Recurring Issue 1': 'Int64', 'Recurring Issue 2': 'Int64'}).set_index(key_columns)
+
+# The index rows for the given keys, as (key, Timestamp, Recurring Issue) entries
+def index_entries(recurring_index, keys):
+    rows = recurring_index.reindex(keys)
+    first = rows[['Timestamp 1', 'Recurring Issue 1']].set_axis(['Timestamp', 'Recurring Issue'], axis=1)
+    second = rows[['Timestamp 2', 'Recurring Issue 2']].set_axis(['Timestamp', 'Recurring Issue'], axis=1)
+    return pd.concat([first, second]).dropna(subset=['Recurring Issue']).reset_index()
+
+# Entries of this run (run_entries) for the given keys, combined with the index rows
+def current_entries(recurring_index, run_entries, keys, key_columns):
+    entries = pd.concat([
+        index_entries(recurring_index, pd.MultiIndex.from_frame(keys)),
+        run_entries.merge(keys, on=key_columns)
+    ], ignore_index=True)
+    return build_recurring_index(entries.astype({'Recurring Issue': 'int64'}), key_columns)
+
+# === Recurring Issue lookup ===
+# Highest 'Recurring Issue' + 1 among earlier rows with the same key but a different
+# Timestamp (0 if none). Only the file's own keys are looked up, in the index and in the
+# entries added earlier in this run, so no file has to scan or rebuild the whole index.
+def find_recurring_issues(df_new, recurring_index, run_entries, key_columns):
+    keys = df_new[key_columns].dropna().drop_duplicates()
+    top = current_entries(recurring_index, run_entries, keys, key_columns)
+
+    merged = df_new[key_columns + ['Timestamp']].merge(top.reset_index(), on=key_columns, how='left')
+    prev_max = merged['Recurring Issue 1'].where(merged['Timestamp 1'] != merged['Timestamp'], merged['Recurring Issue 2'])
+    return (prev_max + 1).fillna(0).astype(int).to_numpy()
+
+# Folds the entries added during this run back into the index
+def merge_run_entries(recurring_index, run_entries, key_columns):
+    if run_entries.empty:
+        return recurring_index
+    keys = run_entries[key_columns].drop_duplicates()
+    updated = current_entries(recurring_index, run_entries, keys, key_columns)
+    return pd.concat([recurring_index[~recurring_index.index.isin(updated.index)], updated])
+
+# === Recurring Issue index cache ===
+# The index is saved as Parquet together with the destination file's mtime and size,
+# so later runs can skip parsing the destination as long as it has not changed since.
+def file_signature(path):
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns}:{stat.st_size}".encode()
+
+def load_recurring_index(index_path, csv_path, key_columns):
+    if not os.path.exists(index_path):
+        return None
+    schema = pq.read_schema(index_path)
+    metadata = schema.metadata or {}
+    if metadata.get(b'destination_signature') != file_signature(csv_path):
+        return None
+    # Caches written in an older layout are rebuilt
+    if schema.names != key_columns + index_columns:
+        return None
+    return pq.read_table(index_path).to_pandas().set_index(key_columns)
+
+def save_recurring_index(recurring_index, index_path, csv_path):
+    table = pa.Table.from_pandas(recurring_index.reset_index(), preserve_index=False)
+    metadata = {**(table.schema.metadata or {}), b'destination_signature': file_signature(csv_path)}
+    pq.write_table(table.replace_schema_metadata(metadata), index_path, compression='zstd')
+
+# === Readers for each supported source file type, parsing only the mapped columns ===
+source_readers = {
+    '.csv': partial(read_csv_as_strings, columns=column_map),
+    '.xlsx': partial(pd.read_excel, dtype=str, engine='calamine', usecols=lambda col: col in column_map),
+}
+
+# === Read a source file and map it onto the destination columns ===
+# Runs in a worker process; returns None if the file has no usable rows.
+def prepare_file(file_path):
+    filename = os.path.basename(file_path)
+
+    # Read source; only the mapped columns are parsed and stripped
     try:
-        if filename.endswith('.csv'):
-            df_src = pd.read_csv(file_path, dtype=str)
-        else:
-            df_src = pd.read_excel(file_path, dtype=str)
-        df_src = df_src.apply(lambda x: x.str.strip() if x.dtype == "object" else x)
+        read_source = source_readers[os.path.splitext(filename)[1].lower()]
+        df_src = strip_columns(read_source(file_path), column_map)
     except Exception as e:
         print(f"Failed to read {filename}: {e}")
-        continue
+        return None
 
     # Select and rename relevant columns
     valid_cols = [col for col in column_map if col in df_src.columns]
     if not valid_cols:
         print(f"No matching columns in: {filename}")
-        continue
+        return None
 
     temp = df_src[valid_cols].rename(columns={k: v for k, v in column_map.items() if k in df_src.columns})
     temp.dropna(how='all', inplace=True)
     if temp.empty:
         print(f"No usable data in: {filename}")
-        continue
+        return None
 
     # Add missing destination columns
     for col in destination_columns:
@@ -114,52 +195,156 @@ for filename in os.listdir(source_dir):
     temp['Issue'] = extract_issue_from_filename(filename)
     temp['Recurring Issue'] = 0
 
+    # Normalize Timestamp to the text written to the destination, so new rows are
+    # compared with existing ones in the same form whether or not the index was cached
+    temp['Timestamp'] = format_timestamps(pd.to_datetime(temp['Timestamp'], errors='coerce'))
+
     # Ensure correct column order
     temp = temp[destination_columns].copy()
 
-    # === Recurring Issue Detection ===
-    key_columns = ['Severity', 'IP', 'Protocol', 'Port', 'State', 'Issue']
-    for col in key_columns:
-        if col not in df_dest.columns:
-            df_dest[col] = ""
-    df_dest['Recurring Issue'] = pd.to_numeric(df_dest['Recurring Issue'], errors='coerce').fillna(0).astype(int)
-
-    for i, new_row in temp.iterrows():
-        matches = df_dest[
-            (df_dest['Severity'] == new_row['Severity']) &
-            (df_dest['IP'] == new_row['IP']) &
-            (df_dest['Protocol'] == new_row['Protocol']) &
-            (df_dest['Port'] == new_row['Port']) &
-            (df_dest['State'] == new_row['State']) &
-            (df_dest['Issue'] == new_row['Issue']) &
-            (df_dest['Timestamp'] != new_row['Timestamp'])
+    return temp
+
+def main():
+    # === Automatically create destination directory if it doesn't exist ===
+    destination_dir = os.path.dirname(destination_file)
+    if not os.path.exists(destination_dir):
+        print(f"Destination directory not found. Creating it at: {destination_dir}")
+        os.makedirs(destination_dir)
+
+    # === Load already processed files ===
+    try:
+        with open(processed_log_path, 'r') as f:
+            processed_files = set(f.read().splitlines())
+    except FileNotFoundError:
+        processed_files = set()
+
+    # === Load destination or create fresh ===
+    # Only the columns needed for recurring issue detection are read; new rows are
+    # appended to the file, so existing rows never need to be rewritten.
+    recurring_columns = key_columns + ['Timestamp', 'Recurring Issue']
+    dest_header = destination_columns
+    recurring_index = None
+    cache_index = True
+    df_dest = pd.DataFrame(columns=recurring_columns)
+    destination_has_data = os.path.exists(destination_file) and os.path.getsize(destination_file) > 0
+    if destination_has_data:
+        try:
+            dest_header = read_csv_header(destination_file)
+            recurring_index = load_recurring_index(recurring_index_path, destination_file, key_columns)
+            if recurring_index is not None:
+                print(f"Loaded cached recurring issue index for: {destination_file}")
+            else:
+                df_dest = strip_columns(
+                    read_csv_as_strings(destination_file, recurring_columns),
+                    key_columns + ['Timestamp']
+                )
+                df_dest = df_dest.astype({col: 'category' for col in category_columns if col in df_dest.columns})
+                print(f"Loaded existing destination file: {destination_file}")
+        except Exception as e:
+            # Appending without the existing rows would miss every recurring issue in them
+            print(f"Failed to read existing destination file: {e}")
+            print("No files were processed; fix or move the destination file and run again.")
+            return
+
+    if recurring_index is None:
+        # Ensure all required columns exist
+        for col in recurring_columns:
+            if col not in df_dest.columns:
+                df_dest[col] = ""
+
+        df_dest['Recurring Issue'] = pd.to_numeric(df_dest['Recurring Issue'], errors='coerce').fillna(0).astype(int)
+        recurring_index = build_recurring_index(df_dest, key_columns)
+
+    # === Track new files processed this run ===
+    newly_processed = []
+    new_chunks = []
+    run_entries = pd.DataFrame(columns=entry_columns, dtype=str).astype({'Recurring Issue': 'int64'})
+
+    # === Process each file ===
+    with os.scandir(source_dir) as entries:
+        source_files = [
+            entry for entry in entries
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in source_readers
         ]
-        if not matches.empty:
-            temp.at[i, 'Recurring Issue'] = matches['Recurring Issue'].max() + 1
 
-    # Combine new rows at top
-    df_dest = pd.concat([temp, df_dest], ignore_index=True)
+    files_to_process = []
+    for entry in source_files:
+        if entry.name in processed_files:
+            print(f"Skipping already processed file: {entry.name}")
+            continue
+        print(f"Processing new file: {entry.name}")
+        files_to_process.append(entry.path)
 
-    # Mark file for logging
-    newly_processed.append(filename)
+    # Read and normalize the new files in parallel; each one is independent.
+    # Worker processes each re-import pandas and pyarrow, so a single file is read here.
+    workers = min(os.cpu_count() or 1, len(files_to_process))
+    if workers > 1:
+        chunksize = max(1, len(files_to_process) // (4 * workers))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            prepared = list(executor.map(prepare_file, files_to_process, chunksize=chunksize))
+    else:
+        prepared = [prepare_file(file_path) for file_path in files_to_process]
 
-# Final sort by Timestamp descending
-df_dest['Timestamp'] = pd.to_datetime(df_dest['Timestamp'], errors='coerce')
-df_dest = df_dest.sort_values(by='Timestamp', ascending=False, na_position='last').reset_index(drop=True)
+    # Recurring issue detection runs in file order, since each file builds on the previous ones
+    for file_path, temp in zip(files_to_process, prepared):
+        if temp is None:
+            continue
+        filename = os.path.basename(file_path)
 
-# Save destination
-try:
-    df_dest.to_csv(destination_file, index=False)
-    print(f"\nDestination file updated: {destination_file}")
-except Exception as e:
-    print(f"Error saving destination file: {e}")
+        # === Recurring Issue Detection ===
+        temp['Recurring Issue'] = find_recurring_issues(temp, recurring_index, run_entries, key_columns)
 
-# Update processed log
-if newly_processed:
-    try:
-        with open(processed_log_path, 'a') as log:
-            for fname in newly_processed:
-                log.write(fname + '\n')
-        print(f"Logged {len(newly_processed)} new files to {processed_log_path}")
-    except Exception as e:
-        print(f"Failed to update processed file log: {e}")
+        # Later files in this run must also see these rows as existing
+        run_entries = pd.concat([run_entries, max_per_timestamp(temp, key_columns)], ignore_index=True)
+
+        # Collect new rows; they are appended to the destination once after the loop
+        new_chunks.append(temp)
+
+        # Mark file for logging
+        newly_processed.append(filename)
+
+    if new_chunks:
+        # Combine new rows, sorted by Timestamp descending.
+        # A stable sort keeps rows with equal timestamps in newest-file-first order.
+        df_new = pd.concat(reversed(new_chunks), ignore_index=True)
+        df_new = df_new.sort_values(
+            by='Timestamp', ascending=False, na_position='last', kind='mergesort',
+            key=lambda ts: pd.to_datetime(ts, format='ISO8601', utc=True, errors='coerce')
+        )
+
+        # Append to destination, matching the existing header's column order
+        try:
+            write_header = not destination_has_data
+            if destination_has_data and not ends_with_newline(destination_file):
+                with open(destination_file, 'ab') as f:
+                    f.write(b'\n')
+            write_csv(df_new.reindex(columns=dest_header), destination_file, mode='ab', include_header=write_header)
+            print(f"\nDestination file updated: {destination_file}")
+        except Exception as e:
+            print(f"Error saving destination file: {e}")
+            cache_index = False
+    else:
+        print("\nNo new files to add to the destination.")
+        cache_index = cache_index and os.path.exists(destination_file)
+
+    # Cache the recurring issue index for the destination as written
+    if cache_index:
+        try:
+            recurring_index = merge_run_entries(recurring_index, run_entries, key_columns)
+            save_recurring_index(recurring_index, recurring_index_path, destination_file)
+        except Exception as e:
+            print(f"Failed to cache recurring issue index: {e}")
+
+    # Update processed log
+    if newly_processed:
+        try:
+            with open(processed_log_path, 'a') as log:
+                for fname in newly_processed:
+                    log.write(fname + '\n')
+            print(f"Logged {len(newly_processed)} new files to {processed_log_path}")
+        except Exception as e:
+            print(f"Failed to update processed file log: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,79 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import os
 import argparse
+from csv_utils import iter_csv_batches, iter_csv_batches_with_pandas
+
+# Approximate number of bytes of the source file parsed into each chunk.
+BLOCK_SIZE = 64 << 20
+
+# Everything up to the third dot-separated field of an IP (e.g., '192.168.1').
+IP_PREFIX_PATTERN = r'^(?P<prefix>[^.]*\.[^.]*\.[^.]*)'
 
 def clean_column_names(df):
     """
-    Cleans up DataFrame column names by stripping whitespace and removing duplicates.
+    Cleans up DataFrame column names by stripping whitespace and renaming duplicates.
     """
     # The user's provided column string suggests there might be duplicates or messy names.
     # This function makes the script more robust.
     
     # Step 1: Strip whitespace from each column name
-    df.columns = [col.strip() for col in df.columns]
+    columns = df.columns.str.strip()
     
-    # Step 2: Handle potential duplicate columns by keeping the first occurrence
-    seen_columns = {}
-    new_columns = []
-    for col in df.columns:
-        if col not in seen_columns:
-            seen_columns[col] = 1
-            new_columns.append(col)
-        else:
-            # If column is a duplicate, append a suffix
-            new_columns.append(f"{col}_{seen_columns[col]}")
-            seen_columns[col] += 1
-            
-    df.columns = new_columns
+    # Step 2: Keep the first occurrence of a name and suffix later ones with _1, _2, ...
+    occurrence = pd.Series(columns).groupby(columns).cumcount().to_numpy()
+    df.columns = columns.where(occurrence == 0, columns + "_" + occurrence.astype(str))
     return df
 
+def ip_prefixes(ip_array):
+    """
+    Extracts the first three octets from an Arrow array of IP addresses using
+    Arrow's native regex kernel. Invalid or empty IP entries are marked as such.
+    """
+    matches = pc.extract_regex(ip_array, pattern=IP_PREFIX_PATTERN)
+    return pc.fill_null(pc.struct_field(matches, 'prefix'), "invalid_ip").to_pandas()
+
+def prefix_filename(prefix):
+    """
+    Returns the output filename for an IP prefix group.
+    """
+    if prefix == "invalid_ip":
+        return "records_with_invalid_ips.csv"
+    # Sanitize the prefix for use as a filename
+    safe_filename = prefix.replace('.', '_')
+    return f"{safe_filename}.csv"
+
+def write_prefix_files(batches, header, output_dir):
+    """
+    Appends the rows of each record batch to the file for their IP prefix and
+    returns the number of records written per prefix.
+    """
+    record_counts = {}
+    ip_position = list(header.columns).index('IP')
+    for batch in batches:
+        # The prefix is computed on the Arrow column before conversion to pandas
+        prefixes = ip_prefixes(batch.column(ip_position))
+        df = batch.to_pandas()
+        df.columns = header.columns
+        df['ip_prefix'] = prefixes.to_numpy()
+
+        # Group the chunk by the newly created 'ip_prefix' column
+        for prefix, group_df in df.groupby('ip_prefix', sort=False):
+            output_path = os.path.join(output_dir, prefix_filename(prefix))
+
+            # Drop the temporary 'ip_prefix' column before saving.
+            # The first write of a prefix in this run replaces any old file.
+            first_write = prefix not in record_counts
+            group_df.drop(columns=['ip_prefix']).to_csv(
+                output_path, mode='w' if first_write else 'a', header=first_write, index=False
+            )
+            record_counts[prefix] = record_counts.get(prefix, 0) + len(group_df)
+    return record_counts
+
 def split_csv_by_ip_prefix(source_file, output_dir):
     """
-    Reads a CSV, groups rows by the first three octets of the 'IP' column,
+    Streams a CSV, groups rows by the first three octets of the 'IP' column,
     and saves each group to a separate CSV file.
     """
     # --- 1. Argument Validation ---
@@ -40,58 +84,43 @@ def split_csv_by_ip_prefix(source_file, output_dir):
     os.makedirs(output_dir, exist_ok=True)
     print(f"Output will be saved to: {output_dir}")
 
-    # --- 2. Read and Prepare the Data ---
+    # --- 2. Check the Source Header ---
     try:
         print(f"Reading source file: {source_file}...")
-        df = pd.read_csv(source_file, dtype=str, low_memory=False)
         
-        # Clean up column names to handle potential formatting issues
-        df = clean_column_names(df)
+        # Read the header with pandas so repeated names get its '.1', '.2' suffixes,
+        # then clean up column names to handle potential formatting issues
+        header = clean_column_names(pd.read_csv(source_file, dtype=str, nrows=0))
 
         # Check if the 'IP' column exists
-        if 'IP' not in df.columns:
+        if 'IP' not in header.columns:
             print(f"Error: 'IP' column not found in the source file.")
-            print(f"   Available columns are: {list(df.columns)}")
+            print(f"   Available columns are: {list(header.columns)}")
             return
             
-        print("✔️ Source file loaded successfully.")
-        
     except Exception as e:
         print(f"Error reading CSV file: {e}")
         return
 
-    # --- 3. Create the IP Prefix for Grouping ---
-    # This function extracts the first three octets (e.g., '192.168.1') from an IP address.
-    # It safely handles invalid or empty IP entries.
-    def get_ip_prefix(ip):
-        if not isinstance(ip, str) or ip.count('.') < 2:
-            return "invalid_ip"
-        return ".".join(ip.split('.')[:3])
-
-    print("Generating IP prefixes for grouping...")
-    df['ip_prefix'] = df['IP'].apply(get_ip_prefix)
+    # --- 3. Stream, Group and Save Files ---
+    # The source is read in chunks; each chunk's rows are appended to the file for
+    # their prefix, so memory use does not grow with the size of the source file.
+    print("Splitting records by IP prefix...")
+    try:
+        try:
+            record_counts = write_prefix_files(iter_csv_batches(source_file, BLOCK_SIZE), header, output_dir)
+        except pa.ArrowInvalid:
+            # Arrow cannot parse some rows (e.g., with too few fields); start over with pandas.
+            # Every prefix file is rewritten from its first row, so no partial output is kept.
+            print("Re-reading the source file with pandas...")
+            record_counts = write_prefix_files(iter_csv_batches_with_pandas(source_file), header, output_dir)
+    except Exception as e:
+        print(f"Error splitting CSV file: {e}")
+        return
 
-    # --- 4. Group and Save Files ---
-    # Group the DataFrame by the newly created 'ip_prefix' column
-    grouped = df.groupby('ip_prefix')
-    
-    print(f"Found {len(grouped)} unique IP prefixes. Writing files...")
-    
-    for prefix, group_df in grouped:
-        if prefix == "invalid_ip":
-            filename = "records_with_invalid_ips.csv"
-        else:
-            # Sanitize the prefix for use as a filename
-            safe_filename = prefix.replace('.', '_')
-            filename = f"{safe_filename}.csv"
-        
-        output_path = os.path.join(output_dir, filename)
-        
-        # Drop the temporary 'ip_prefix' column before saving
-        group_df_to_save = group_df.drop(columns=['ip_prefix'])
-        
-        group_df_to_save.to_csv(output_path, index=False)
-        print(f"   -> Saved {len(group_df_to_save)} records to {filename}")
+    print(f"Found {len(record_counts)} unique IP prefixes.")
+    for prefix in sorted(record_counts):
+        print(f"   -> Saved {record_counts[prefix]} records to {prefix_filename(prefix)}")
 
     print("\nSplitting process complete!")
 